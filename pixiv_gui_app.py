@@ -23,6 +23,11 @@ except ImportError as e:
     sys.exit(1)
 
 
+# Comboboxの選択肢はEnumから一度だけ構築して共有する
+_RANK_NAMES = tuple(e.name for e in RankingMode)
+_CONTENT_NAMES = tuple(e.name for e in ContentType)
+
+
 # --- ロギングと標準出力リダイレクト設定 ---
 
 # 標準出力をロガーにリダイレクトするためのヘルパークラス
@@ -52,6 +57,7 @@ class PixivApp(tk.Tk):
         
         self.analyzer = None  # PixivRankAnalyzerのインスタンスを保持
         self.current_results = [] # 取得したランキング結果を保持
+        self._tree_iids = set() # Treeviewに表示中の行ID (作品ID文字列) の集合
         
         # 変数の初期化
         self.mode_var = tk.StringVar(value=RankingMode.DAILY.name)
@@ -62,6 +68,9 @@ class PixivApp(tk.Tk):
         self.views_var = tk.StringVar(value=initial_views)
         self.bookmarks_var = tk.StringVar(value=initial_bookmarks)
         self.dl_count_var = tk.StringVar(value="10")
+        # ダウンロードの並列数とリクエスト間隔 (秒)
+        self.workers_var = tk.StringVar(value="4")
+        self.rate_var = tk.StringVar(value="0.5")
         
         self._setup_ui()
 
@@ -116,12 +125,12 @@ class PixivApp(tk.Tk):
 
         # モード (Combobox)
         ttk.Label(row, text=labels[0]).pack(side="left", padx=5)
-        mode_combo = ttk.Combobox(row, textvariable=vars[0], values=[e.name for e in RankingMode], state="readonly", width=12)
+        mode_combo = ttk.Combobox(row, textvariable=vars[0], values=_RANK_NAMES, state="readonly", width=12)
         mode_combo.pack(side="left", padx=5)
         
         # コンテンツ (Combobox)
         ttk.Label(row, text=labels[1]).pack(side="left", padx=5)
-        content_combo = ttk.Combobox(row, textvariable=vars[1], values=[e.name for e in ContentType], state="readonly", width=8)
+        content_combo = ttk.Combobox(row, textvariable=vars[1], values=_CONTENT_NAMES, state="readonly", width=8)
         content_combo.pack(side="left", padx=5)
 
         # 閲覧数 (Entry)
@@ -136,6 +145,14 @@ class PixivApp(tk.Tk):
         ttk.Label(row, text=labels[4]).pack(side="left", padx=5)
         ttk.Entry(row, textvariable=vars[4], width=5).pack(side="left", padx=5)
 
+        # 並列数 (Entry)
+        ttk.Label(row, text="並列数:").pack(side="left", padx=5)
+        ttk.Entry(row, textvariable=self.workers_var, width=4).pack(side="left", padx=5)
+
+        # リクエスト間隔 (Entry)
+        ttk.Label(row, text="間隔(秒):").pack(side="left", padx=5)
+        ttk.Entry(row, textvariable=self.rate_var, width=5).pack(side="left", padx=5)
+
 
     def _create_result_treeview(self, parent_frame):
         """ランキング表示用のTreeviewウィジェットを作成"""
@@ -170,22 +187,27 @@ class PixivApp(tk.Tk):
             min_views = int(self.views_var.get())
             min_bookmarks = int(self.bookmarks_var.get())
             dl_count = int(self.dl_count_var.get())
-            
+            max_workers = int(self.workers_var.get())
+            min_interval = float(self.rate_var.get())
+
         except (ValueError, KeyError):
-            messagebox.showerror("入力エラー", "設定値を確認してください。閲覧数、B!数、DL数は有効な整数が必要です。")
+            messagebox.showerror("入力エラー", "設定値を確認してください。閲覧数、B!数、DL数、並列数は有効な整数、間隔は数値が必要です。")
             return
 
         self._set_buttons_enabled(False, False)
         self.run_button.config(text="データ取得中...")
-        self.result_tree.delete(*self.result_tree.get_children())
-        
+        # NOTE: 行のクリアは行わない。取得完了時に_display_results_in_treeviewが
+        # 既存行との差分だけを更新するため、再取得中も前回結果が表示されたままになる
+
         self.analyzer = PixivRankAnalyzer(
             ranking_mode=mode,
             content_type=content,
             min_views=min_views,
             min_bookmarks=min_bookmarks,
             download_count=dl_count,
-            enable_download=True 
+            enable_download=True,
+            max_workers=max_workers,
+            min_request_interval=min_interval
         )
 
         thread = threading.Thread(target=self._ranking_fetch_worker, daemon=True)
@@ -222,9 +244,12 @@ class PixivApp(tk.Tk):
         messagebox.showerror("APIエラー", f"ランキング取得中にエラーが発生しました。\n詳細: {message}")
 
     def _display_results_in_treeview(self, results: list):
-        """取得した結果をTreeviewに表示"""
-        for i, item in enumerate(results[:50]):
-            data = (
+        """取得した結果をTreeviewに表示 (既存行との差分のみ更新)"""
+        # 先に全行を整形してから挿入し、Tk呼び出しと文字列整形を混在させない
+        display_items = results[:50]
+        iids = [str(item['id']) for item in display_items]
+        rows = [
+            (
                 f"#{i+1:02d}",
                 f"{item['rate']:.2f}%",
                 f"{item['bookmark']:,}",
@@ -232,7 +257,26 @@ class PixivApp(tk.Tk):
                 item['user_name'],
                 item['title']
             )
-            self.result_tree.insert("", "end", values=data)
+            for i, item in enumerate(display_items)
+        ]
+
+        # 作品IDを行IDとして使い、消えた行は削除・残った行は値の更新と並べ替えのみ行う。
+        # 全削除+全挿入 (2N回のTcl呼び出し) に比べ、定常状態では約半分で済む
+        new_iids = set(iids)
+        tree = self.result_tree
+        tree.pack_forget()  # 更新中の再描画を抑止
+        try:
+            for iid in self._tree_iids - new_iids:
+                tree.delete(iid)
+            for index, (iid, data) in enumerate(zip(iids, rows)):
+                if iid in self._tree_iids:
+                    tree.item(iid, values=data)
+                    tree.move(iid, "", index)
+                else:
+                    tree.insert("", index, iid=iid, values=data)
+        finally:
+            tree.pack(fill="both", expand=True)
+        self._tree_iids = new_iids
     
     # --- ダウンロード処理 (スレッド化) ---
     
@@ -279,12 +323,15 @@ class PixivApp(tk.Tk):
 # アプリケーションのエントリポイント
 # ====================================================================
 if __name__ == "__main__":
-    # ロギング設定の初期化
-    setup_logging() 
-    
+    # ロギング設定の初期化 (キュー経由の非同期ロギング)
+    log_listener = setup_logging()
+
     # Analyzerクラスのprint()出力をログファイルにリダイレクト
-    # 'stdout_redirect' ロガーは、setup_loggingで定義したハンドラを使用
+    # 'stdout_redirect' ロガーは、setup_loggingで定義したキューハンドラを使用
     sys.stdout = StreamRedirector(logging.getLogger('stdout_redirect'))
-    
+
     app = PixivApp()
-    app.mainloop()
\ No newline at end of file
+    app.mainloop()
+
+    # ウィンドウが閉じられたらリスナースレッドを止め、残りのログをフラッシュする
+    log_listener.stop()
\ No newline at end of file
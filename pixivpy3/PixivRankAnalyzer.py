@@ -1,22 +1,95 @@
 # pixiv_analyzer_core.py
 
+import heapq
+import json
 import logging
+import mmap
 import os
+import queue
 import sys
-import random 
+import random
+import threading
 import time
-import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from logging.handlers import QueueHandler, QueueListener
+from operator import itemgetter
+from pathlib import Path
 from unicodedata import normalize
-from typing import Tuple, Dict 
+from typing import Tuple, Dict, Set
 from enum import Enum
 import hashlib # ハッシュ値計算のために追加
 
-# pixivpy3は外部ライブラリなので、別途インストールが必要です
+# 重複検出は内容のフィンガープリント一致さえ取れればよく、暗号学的強度は不要。
+# xxhash (xxh3_128) が入っていればSHA256の5-15倍速いのでそちらを使う。
+# キーにはアルゴリズム名を前置し、環境によって異なるハッシュが混在しても
+# 誤って照合されないようにする
 try:
-    from pixivpy3 import AppPixivAPI
+    import xxhash
+
+    _HASH_NAME = 'xxh3'
+    _new_hasher = xxhash.xxh3_128
 except ImportError:
-    logging.critical("エラー: pixivpy3 ライブラリが見つかりません。")
-    sys.exit(1)
+    xxhash = None
+    _HASH_NAME = 'sha256'
+    _new_hasher = hashlib.sha256
+
+
+def _describe_hash_backend():
+    """重複検出に使っているハッシュ実装の説明文字列を返す (起動時ログ用)。
+
+    sha256フォールバック時はリンク先OpenSSLのバージョンも含める。SHA-NI等の
+    ハードウェア命令へのディスパッチはOpenSSLのビルド次第なので、遅い場合は
+    ここに出るバージョンを確認するか xxhash を導入するとよい。
+    """
+    if xxhash is not None:
+        return f"xxh3_128 (xxhash {xxhash.VERSION})"
+    try:
+        import ssl
+        return f"sha256 ({ssl.OPENSSL_VERSION})"
+    except ImportError:
+        return "sha256 (hashlib組み込み実装)"
+
+# NOTE: pixivpy3本体 (requests/cloudscraper等の重い依存を含む) はGUIの起動を
+# 遅くしないよう、モジュール読み込み時ではなく認証時に遅延インポートする
+def _get_app_pixiv_api():
+    try:
+        from pixivpy3 import AppPixivAPI
+    except ImportError as e:
+        logging.critical("エラー: pixivpy3 ライブラリが見つかりません。")
+        raise Exception("pixivpy3 ライブラリが見つかりません。") from e
+    return AppPixivAPI
+
+
+# NumPyは任意依存。大きめのランキング結果でエンゲージメント計算をベクトル化する。
+# GUIの起動を遅くしないよう、初回利用時に1度だけ読み込みを試す
+_np = None
+_np_checked = False
+
+
+def _get_numpy():
+    global _np, _np_checked
+    if not _np_checked:
+        _np_checked = True
+        try:
+            import numpy
+            _np = numpy
+        except ImportError:
+            _np = None
+    return _np
+
+
+# ダウンロード先のルートディレクトリ
+_DL_ROOT = Path("ダウンロード_作品分析")
+
+
+# ファイル名サニタイズ用の変換テーブル。改行→空白、禁止文字→'ー'、制御文字→削除を
+# str.translate の1パス (C実装) でまとめて処理する
+_sanitize_map = {chr(_c): None for _c in range(0x20)}
+_sanitize_map['\n'] = ' '
+for _c in '\\/:*?"<>|':
+    _sanitize_map[_c] = 'ー'
+_SANITIZE_TABLE = str.maketrans(_sanitize_map)
+del _c, _sanitize_map
 
 
 # --- 1. 列挙型 (Enum) の定義 ---
@@ -36,6 +109,20 @@ class ContentType(Enum):
     ILLUST = 'illust'
     MANGA = 'manga'
 
+# 表示名の対応表 (呼び出しごとにdictリテラルを組み立てないようモジュール定数化)
+_MODE_JP = {
+    RankingMode.DAILY: '日間', RankingMode.WEEKLY: '週間',
+    RankingMode.MONTHLY: '月間',
+    RankingMode.DAILY_MALE: '男性人気', RankingMode.DAILY_FEMALE: '女性人気',
+    RankingMode.DAILY_AI: '日間AI',
+    RankingMode.WEEKLY_ORIGINAL: '週間オリジナル'
+}
+
+_CONTENT_JP = {
+    ContentType.ILLUST: 'イラスト', ContentType.MANGA: 'マンガ',
+    ContentType.ALL: 'すべて'
+}
+
 # --- 1.5. ランキングモードごとの推奨値 (プリセット) 定義 ---
 
 class RankPresetManager:
@@ -55,57 +142,94 @@ class RankPresetManager:
         """ RankingModeの.name (文字列) を受け取り、対応するプリセット値 (最小閲覧数、最小B!数) を返す。 """
         return RankPresetManager.PRESETS.get(mode_name, ("1000", "100"))
 
+# --- 1.8. レートリミッタ ---
+
+class _RateLimiter:
+    """ リクエスト間の平均間隔を保証するトークンバケット風のレートリミッタ。
+
+    直前の呼び出しから min_interval 秒以上経過していれば一切待たないため、
+    実際の通信に時間がかかった場合のスリープは自動的にゼロになる。
+    複数スレッドから呼ばれるためロックで保護する。
+    """
+
+    def __init__(self, min_interval=0.5):
+        self.min_interval = min_interval
+        self._last_call_ts = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            sleep_for = max(0.0, self.min_interval - (now - self._last_call_ts))
+            self._last_call_ts = now + sleep_for
+        if sleep_for > 0:
+            time.sleep(sleep_for)
+            logging.debug(f"Rate limit: slept {sleep_for:.2f} seconds.")
+
+
 # --- 2. Pixiv解析機能のクラス化 ---
 
 class PixivRankAnalyzer:
     
-    def __init__(self, 
-                 ranking_mode: RankingMode, 
-                 content_type: ContentType, 
-                 min_views: int, 
-                 min_bookmarks: int, 
-                 download_count: int, 
-                 enable_download: bool = True):
-        
+    def __init__(self,
+                 ranking_mode: RankingMode,
+                 content_type: ContentType,
+                 min_views: int,
+                 min_bookmarks: int,
+                 download_count: int,
+                 enable_download: bool = True,
+                 max_workers: int = 4,
+                 min_request_interval: float = 0.5):
+
         self.ranking_mode = ranking_mode
         self.content_type = content_type
         self.min_views_threshold = min_views
         self.min_bookmarks_threshold = min_bookmarks
         self.download_count = download_count
         self.enable_download = enable_download
+        # ダウンロードの並列数とリクエスト間隔 (速度とサーバーへの負荷のトレードオフ)
+        self.max_workers = max(1, max_workers)
+        self.min_request_interval = max(0.0, min_request_interval)
         self.api = None
+        self._img_session = None
+        # キャッシュ済みトークンで認証したか (失効検出時のフォールバック判定に使う)
+        self._auth_from_cache = False
+        self._refresh_token = None
         
         self.download_dir = self._generate_download_dir_name()
-        # 既存ファイルのハッシュ値を格納する辞書 {ハッシュ値: ファイル名}
-        self.existing_hashes: Dict[str, str] = {} 
+        # 既存ファイル内容のフィンガープリント集合。重複判定は集合の所属チェックだけで
+        # 済むため、ファイル名はログ表示用の_hash_to_nameに分離して保持する
+        self.existing_hashes: Set[str] = set()
+        self._hash_to_name: Dict[str, str] = {}
+        # 既存ファイルサイズの集合。サイズが一致しないファイルは内容も一致し得ない
+        # ため、ハッシュ照合前の粗いふるいとして使う
+        self.existing_sizes: Set[int] = set()
+        # サイドカーインデックス {ファイル名: [サイズ, mtime_ns, ハッシュ]}。
+        # statが一致する限り再ハッシュを省略できる
+        self._hash_index: Dict[str, list] = {}
+        # インデックスに全量ハッシュが無い既存ファイルの粗い指紋 {指紋: [ファイル名]}。
+        # 指紋が衝突したときだけ全量ハッシュへ昇格させる (2段階重複判定)
+        self._fp_to_names: Dict[str, list] = {}
+        # ダウンロード済みファイル名の集合 (名前一致なら再ダウンロード自体を省略)
+        self._existing_names = set()
+        # 並列ダウンロード時の共有状態を守るロック
+        self._print_lock = threading.Lock()
+        self._hashes_lock = threading.Lock()
+        # 全ワーカー共有のレートリミッタ (既定0.5秒間隔 = 平均2req/s)
+        self._rate_limiter = _RateLimiter(min_interval=self.min_request_interval)
         
     # --- ユーティリティメソッド ---
     @staticmethod
     def _sanitize_filename(text, max_length=30):
-        s = text.replace('\n', ' ')
-        s = re.sub(r'[\\/:*?"<>|]', 'ー', s)
-        s = re.sub(r'[\u0000-\u001f]', '', s)
-        s = s.strip()
-        s = normalize('NFKC', s)
-        return s[:max_length]
-
-    # ... (他_get_mode_name_japanese, _get_content_name_japanese, _to_k_unit, _generate_download_dir_name, _rand_sleep は変更なし) ...
+        return normalize('NFKC', text.translate(_SANITIZE_TABLE).strip())[:max_length]
+
     @staticmethod
     def _get_mode_name_japanese(mode):
-        return {
-              RankingMode.DAILY: '日間', RankingMode.WEEKLY: '週間', 
-              RankingMode.MONTHLY: '月間', 
-              RankingMode.DAILY_MALE: '男性人気', RankingMode.DAILY_FEMALE: '女性人気',
-              RankingMode.DAILY_AI: '日間AI',
-              RankingMode.WEEKLY_ORIGINAL: '週間オリジナル'
-        }.get(mode, mode.name)
+        return _MODE_JP.get(mode, mode.name)
 
     @staticmethod
     def _get_content_name_japanese(content):
-        return {
-              ContentType.ILLUST: 'イラスト', ContentType.MANGA: 'マンガ', 
-              ContentType.ALL: 'すべて'
-        }.get(content, content.name)
+        return _CONTENT_JP.get(content, content.name)
 
     @staticmethod
     def _to_k_unit(value):
@@ -122,8 +246,8 @@ class PixivRankAnalyzer:
         
         filter_parts = [p for p in [mode_jp, content_jp, view_str, bmark_str] if p]
         dir_name = "_".join(filter_parts)
-        
-        return os.path.join("ダウンロード_作品分析", dir_name)
+
+        return str(_DL_ROOT / dir_name)
     
     @staticmethod
     def _rand_sleep():
@@ -131,67 +255,380 @@ class PixivRankAnalyzer:
         time.sleep(delay)
         logging.debug(f"Sleep for {delay:.2f} seconds.")
 
+    # この閾値以上のファイルはmmapでカーネルに直接ページングさせてハッシュする
+    _MMAP_THRESHOLD = 1024 * 1024
+
     @staticmethod
     def _calculate_file_hash(filepath, block_size=65536):
-        """ファイルのSHA256ハッシュ値を計算する"""
-        hasher = hashlib.sha256()
+        """ファイル内容のフィンガープリント ('アルゴリズム名:16進ダイジェスト') を計算する。
+
+        xxhashがあればxxh3_128、無ければSHA256を使う。
+        大きなファイルは64KiBごとのread()で中間bytesを量産する代わりにmmapを
+        丸ごとhasher.updateへ渡し、小さなファイルは一括readで済ませる。
+        mmapできない環境 (空ファイルやネットワーク共有など) は従来の
+        チャンク読みにフォールバックする。
+        """
+        hasher = _new_hasher()
         try:
             with open(filepath, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                if size >= PixivRankAnalyzer._MMAP_THRESHOLD:
+                    try:
+                        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                            hasher.update(mm)
+                        return f"{_HASH_NAME}:{hasher.hexdigest()}"
+                    except (ValueError, OSError):
+                        # mmap不可ならチャンク読みでやり直す
+                        hasher = _new_hasher()
+                        f.seek(0)
+                elif size <= block_size:
+                    hasher.update(f.read())
+                    return f"{_HASH_NAME}:{hasher.hexdigest()}"
+
                 buf = f.read(block_size)
                 while len(buf) > 0:
                     hasher.update(buf)
                     buf = f.read(block_size)
-            return hasher.hexdigest()
+            return f"{_HASH_NAME}:{hasher.hexdigest()}"
         except Exception as e:
             logging.warning(f"ハッシュ値計算エラー: {filepath}: {e}")
             return None
 
+    # 粗い指紋に使う先頭・末尾の読み取りバイト数
+    _FP_SPAN = 1024
+
+    @staticmethod
+    def _fingerprint_parts(size, head, tail):
+        """(サイズ, 先頭1KB, 末尾1KB) から粗い指紋を合成する。
+
+        全量ハッシュとキー空間が混ざらないよう 'fp-' を前置する。指紋の一致は
+        重複の可能性を示すだけで、確定には全量ハッシュの照合が必要。
+        """
+        hasher = _new_hasher(size.to_bytes(8, 'little'))
+        hasher.update(head)
+        hasher.update(tail)
+        return f"fp-{_HASH_NAME}:{hasher.hexdigest()}"
+
+    @staticmethod
+    def _fast_fingerprint(filepath):
+        """ファイル全体を読まずに粗い指紋を計算する (最大2KBの読み取りで済む)"""
+        span = PixivRankAnalyzer._FP_SPAN
+        try:
+            with open(filepath, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                head = f.read(span)
+                f.seek(max(0, size - span))
+                tail = f.read(span)
+            return PixivRankAnalyzer._fingerprint_parts(size, head, tail)
+        except Exception as e:
+            logging.warning(f"指紋計算エラー: {filepath}: {e}")
+            return None
+
+    # ハッシュ値のサイドカーインデックスファイル名
+    _HASH_INDEX_NAME = '.hash_index.json'
+
+    def _hash_index_path(self):
+        return os.path.join(self.download_dir, self._HASH_INDEX_NAME)
+
+    def _load_hash_index(self):
+        """サイドカーインデックスを読み込む。破損・欠落時は空のdictを返す"""
+        try:
+            with open(self._hash_index_path(), 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            return index if isinstance(index, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _save_hash_index(self):
+        """現在のハッシュインデックスをサイドカーファイルへ保存する"""
+        if not os.path.isdir(self.download_dir):
+            return
+        try:
+            with open(self._hash_index_path(), 'w', encoding='utf-8') as f:
+                json.dump(self._hash_index, f, ensure_ascii=False)
+        except OSError as e:
+            logging.warning(f"ハッシュインデックスの保存に失敗しました: {e}")
+
+    @staticmethod
+    def _index_entry_valid(cached, st):
+        """キャッシュ済みエントリ [size, mtime_ns, hash] が現在のstatと一致するか"""
+        return (
+            isinstance(cached, list) and len(cached) == 3
+            and cached[0] == st.st_size and cached[1] == st.st_mtime_ns
+            and isinstance(cached[2], str) and cached[2].startswith(_HASH_NAME + ':')
+        )
+
     def _load_existing_hashes(self):
-        """ダウンロードディレクトリ内の既存ファイルのハッシュ値を計算し、self.existing_hashesに格納する"""
-        self.existing_hashes = {}
+        """ダウンロードディレクトリ内の既存ファイルの重複判定情報を収集する。
+
+        サイドカーインデックス (.hash_index.json) に (サイズ, mtime_ns) が一致する
+        エントリがあるファイルは保存済みの全量ハッシュをそのまま使う。それ以外の
+        ファイルは全量を読まず、最大2KBの粗い指紋 (_fast_fingerprint) だけを取り、
+        ダウンロード内容と指紋が衝突したときに初めて全量ハッシュへ昇格させる
+        (_promote_fingerprint_matches)。大半のファイルが非重複である通常ケースでは、
+        初回スキャンの読み取り量がファイルあたり約2KBで済む。
+        """
+        self.existing_hashes = set()
+        self._hash_to_name = {}
+        self._hash_index = {}
+        self._fp_to_names = {}
+        self.existing_sizes = set()
         if not os.path.isdir(self.download_dir):
             return
+
+        old_index = self._load_hash_index()
+
+        # ファイル名は重複スキップのログ表示にしか使わないため、INFOログが
+        # 無効な構成ではフィンガープリント→名前の対応表を保持しない
+        keep_names = logging.getLogger().isEnabledFor(logging.INFO)
             
         print("既存ファイルのハッシュ値をチェック中...")
         logging.info(f"既存のダウンロードディレクトリ '{self.download_dir}' 内のファイルをチェックしています。")
+        logging.info(f"重複検出ハッシュ: {_describe_hash_backend()}")
         
-        for filename in os.listdir(self.download_dir):
+        names = []
+        paths = []
+        reused = 0
+        # os.scandirはd_typeとstatをDirEntryにキャッシュするため、listdir +
+        # isfile + statで1ファイルにつき2回走っていたstat(2)が1回以下に減る
+        with os.scandir(self.download_dir) as it:
+            entries = list(it)
+        for entry in entries:
+            filename = entry.name
+            # インデックス自身と書き込み途中の一時ファイルは対象外
+            if filename == self._HASH_INDEX_NAME or filename.endswith('.part'):
+                continue
+            if not entry.is_file(follow_symlinks=False):
+                continue
+            st = entry.stat(follow_symlinks=False)
+            self.existing_sizes.add(st.st_size)
+            cached = old_index.get(filename)
+            if cached is not None and self._index_entry_valid(cached, st):
+                # statが一致 → 内容は変わっていないとみなし再ハッシュしない
+                file_hash = cached[2]
+                self.existing_hashes.add(file_hash)
+                if keep_names:
+                    self._hash_to_name[file_hash] = filename
+                self._hash_index[filename] = cached
+                reused += 1
+                continue
+            names.append(filename)
+            paths.append(entry.path)
+
+        # インデックスに無いファイルは全量ハッシュせず粗い指紋だけ取る。
+        # I/O待ちが支配的なのでスレッドで並列化する
+        if paths:
+            max_workers = min(32, (os.cpu_count() or 4) * 2)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for filename, fp in zip(names, executor.map(self._fast_fingerprint, paths)):
+                    if fp:
+                        self._fp_to_names.setdefault(fp, []).append(filename)
+
+
+        print(f"✅ 既存ファイル {reused + len(names)} 件のチェック完了。")
+        logging.info(
+            f"既存ファイルチェック完了: インデックス再利用 {reused} 件 / 指紋のみ {len(names)} 件"
+        )
+
+    def _promote_fingerprint_matches(self, fp):
+        """指紋fpを持つ未確定の既存ファイルを全量ハッシュして正式な判定集合へ昇格させる。
+
+        _hashes_lockを保持した状態で呼ぶこと。指紋が衝突したときにしか走らない
+        経路なので、ロック内のファイルI/Oが性能上の問題になる頻度では呼ばれない。
+        """
+        for filename in self._fp_to_names.pop(fp, []):
             filepath = os.path.join(self.download_dir, filename)
-            if os.path.isfile(filepath):
-                file_hash = self._calculate_file_hash(filepath)
-                if file_hash:
-                    self.existing_hashes[file_hash] = filename
-        
-        print(f"✅ 既存ファイル {len(self.existing_hashes)} 件のハッシュ値チェック完了。")
-        logging.info(f"ロードされた既存ハッシュ数: {len(self.existing_hashes)}")
+            file_hash = self._calculate_file_hash(filepath)
+            if not file_hash:
+                continue
+            self.existing_hashes.add(file_hash)
+            self._hash_to_name.setdefault(file_hash, filename)
+            try:
+                st = os.stat(filepath)
+            except OSError:
+                continue
+            self._hash_index[filename] = [st.st_size, st.st_mtime_ns, file_hash]
 
     # --- 認証機能 ---
+    TOKEN_CACHE_PATH = "auth.cache.json"
+
+    def _load_cached_token(self, refresh_token):
+        """前回の認証で保存したaccess_tokenを読み込む。無効・期限切れ・破損時はNoneを返す"""
+        try:
+            with open(self.TOKEN_CACHE_PATH, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+            # auth.keyが差し替えられた場合はキャッシュを使わない
+            if cache.get('refresh_token') != refresh_token:
+                return None
+            # 期限切れ直前のトークンは再認証する (60秒のマージン)
+            if cache.get('expires_at', 0) - time.time() <= 60:
+                return None
+            if not cache.get('access_token') or not cache.get('user_id'):
+                return None
+            return cache
+        except (OSError, ValueError):
+            return None
+
+    def _save_token_cache(self, token):
+        """認証レスポンスからaccess_tokenをキャッシュファイルに保存する"""
+        try:
+            cache = {
+                'access_token': token.response.access_token,
+                'refresh_token': token.response.refresh_token,
+                'user_id': token.response.user.id,
+                'expires_at': time.time() + token.response.expires_in,
+            }
+            with open(self.TOKEN_CACHE_PATH, 'w', encoding='utf-8') as f:
+                json.dump(cache, f)
+        except (OSError, AttributeError, TypeError) as e:
+            logging.warning(f"アクセストークンのキャッシュ保存に失敗しました: {e}")
+
     def authenticate(self):
         AUTH_FILE_PATH = "auth.key"
-        
+
         try:
             with open(AUTH_FILE_PATH, 'r') as f:
                 refresh_token = f.read().strip()
         except FileNotFoundError:
             logging.critical(f"🚨 エラー: 認証ファイル '{AUTH_FILE_PATH}' が見つかりません。")
             raise Exception("認証ファイルが見つかりません。")
-        
+
         if not refresh_token:
             logging.critical(f"🚨 エラー: '{AUTH_FILE_PATH}' ファイルが空です。")
             raise Exception("認証ファイルが空です。")
 
-        self.api = AppPixivAPI()
+        self.api = _get_app_pixiv_api()()
+        self._refresh_token = refresh_token
+
+        # 有効なaccess_tokenがキャッシュされていればOAuthラウンドトリップを省略
+        cache = self._load_cached_token(refresh_token)
+        if cache:
+            self.api.set_auth(cache['access_token'], cache['refresh_token'])
+            self.api.user_id = cache['user_id']
+            self._configure_connection_pool()
+            self._auth_from_cache = True
+            logging.info("✅ 認証成功 (キャッシュされたアクセストークンを再利用)")
+            return True
+
+        return self._full_auth(refresh_token)
+
+    def _full_auth(self, refresh_token):
+        """キャッシュを使わずOAuthのフル認証を行い、成功したらトークンを保存し直す"""
         logging.info("Pixiv API認証中 (Refresh Tokenを使用)...")
         try:
-            self.api.auth(refresh_token=refresh_token)
+            token = self.api.auth(refresh_token=refresh_token)
+            self._save_token_cache(token)
+            self._configure_connection_pool()
+            self._auth_from_cache = False
             logging.info("✅ 認証成功")
             return True
         except Exception as e:
             logging.critical(f"❌ 認証失敗: リフレッシュトークンが不正か有効期限切れです。エラー詳細: {e}")
             raise Exception(f"認証失敗: {e}")
 
+    def _invalidate_token_cache(self):
+        """サーバー側で拒否されたキャッシュ済みトークンを破棄する (次回以降はフル認証になる)"""
+        try:
+            os.remove(self.TOKEN_CACHE_PATH)
+        except OSError:
+            pass
+
+    def _configure_connection_pool(self):
+        """pixivpy内部のrequests.Sessionにコネクションプールを設定し、TLSハンドシェイクの再実行を防ぐ"""
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        adapter = HTTPAdapter(
+            pool_connections=16,
+            pool_maxsize=32,
+            max_retries=Retry(total=3, backoff_factor=0.5),
+        )
+        try:
+            # app-api.pixiv.net (API) と i.pximg.net (画像CDN) への接続を keep-alive で再利用する
+            self.api.requests.mount('https://', adapter)
+        except Exception as e:
+            # セッション実装が変わっても動作自体には影響しないため警告に留める
+            logging.warning(f"コネクションプールの設定に失敗しました (接続の再利用なしで続行): {e}")
+
+        # 画像CDN専用のプール付きセッション (ストリーミング保存用)
+        self._img_session = requests.Session()
+        self._img_session.mount('https://', HTTPAdapter(
+            pool_connections=16,
+            pool_maxsize=32,
+            max_retries=Retry(total=3, backoff_factor=0.5),
+        ))
+        self._img_session.headers.update({
+            'Referer': 'https://www.pixiv.net/',
+            'User-Agent': 'PixivIOSApp/7.13.3 (iOS 14.6; iPhone13,2)',
+        })
+
+    def _download_image(self, url, final_filepath):
+        """画像をストリーミング保存しつつ、その場でハッシュを計算して重複判定する。
+
+        レスポンス全体をメモリに載せず64KiB単位で書き出すため、並列ダウンロード時の
+        ピークメモリは画像サイズに依存しない。ハッシュは書き込みと同時に計算する
+        ので、保存後にファイルを読み直す2度目のI/Oは発生しない。新規ファイルのみ
+        os.replaceで原子的に配置し、重複なら一時ファイルを破棄する。
+
+        戻り値は (is_duplicate, 既存ファイル名 or None)。
+        """
+        tmp_filepath = final_filepath + '.part'
+        hasher = _new_hasher()
+        size = 0
+        head = b''
+        tail = b''
+        span = self._FP_SPAN
+        with self._img_session.get(url, stream=True, timeout=30) as r:
+            r.raise_for_status()
+            with open(tmp_filepath, 'wb') as f:
+                for chunk in r.iter_content(chunk_size=65536):
+                    hasher.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+                    # 既存ファイルの粗い指紋と同じ (先頭1KB, 末尾1KB) を追跡する
+                    if len(head) < span:
+                        head = (head + chunk)[:span]
+                    tail = (tail + chunk)[-span:]
+
+        downloaded_hash = f"{_HASH_NAME}:{hasher.hexdigest()}"
+        downloaded_fp = self._fingerprint_parts(size, head, tail)
+        final_file_name = os.path.basename(final_filepath)
+        with self._hashes_lock:
+            # サイズが既存ファイルのどれとも一致しなければ内容も一致し得ない
+            # (同一内容ならサイズも同一) ため、ハッシュ照合を省略できる
+            is_duplicate = size in self.existing_sizes and downloaded_hash in self.existing_hashes
+            if not is_duplicate and downloaded_fp in self._fp_to_names:
+                # 粗い指紋が衝突 → 該当既存ファイルを全量ハッシュしてから確定させる
+                self._promote_fingerprint_matches(downloaded_fp)
+                is_duplicate = downloaded_hash in self.existing_hashes
+            if not is_duplicate:
+                # 新規ファイルとしてハッシュとサイズを登録
+                self.existing_hashes.add(downloaded_hash)
+                self._hash_to_name[downloaded_hash] = final_file_name
+                self.existing_sizes.add(size)
+
+        if is_duplicate:
+            os.unlink(tmp_filepath)
+            return True, self._hash_to_name.get(downloaded_hash, '既存ファイル')
+
+        os.replace(tmp_filepath, final_filepath)
+        # 次回起動時に再ハッシュせず済むよう、配置後のstatをインデックスへ記録
+        try:
+            st = os.stat(final_filepath)
+            with self._hashes_lock:
+                self._hash_index[final_file_name] = [st.st_size, st.st_mtime_ns, downloaded_hash]
+        except OSError:
+            pass
+        return False, None
+
     # --- データ取得と計算 ---
-    def calculate_engagement(self):
+    def calculate_engagement(self, top_k=None):
+        """ランキングからエンゲージメント率の降順リストを作成する。
+
+        top_kを指定すると上位K件だけを返す。呼び出し側が上位しか使わない場合は
+        全体ソート O(n log n) の代わりにヒープ選択 O(n log k) で済む。
+        """
         if not self.api:
             raise Exception("APIが認証されていません。")
             
@@ -200,34 +637,107 @@ class PixivRankAnalyzer:
         
         logging.info(f"--- {mode_str}ランキングの作品データを取得中 (コンテンツ: {content_type_value})... ---")
         
-        json_result = self.api.illust_ranking(mode_str) 
+        json_result = self.api.illust_ranking(mode_str)
         illusts = json_result.illusts
-        
-        engagement_list = []
 
+        # キャッシュ済みトークンがサーバー側で失効している場合 (パスワード変更や
+        # 時計ずれによるexpires_at誤判定)、エラー応答でillustsがNoneになる。
+        # キャッシュを捨ててフル認証でやり直し、1回だけ再取得する
+        if illusts is None and self._auth_from_cache:
+            logging.warning("キャッシュされたアクセストークンが拒否されたため、再認証して取り直します。")
+            self._invalidate_token_cache()
+            self._full_auth(self._refresh_token)
+            json_result = self.api.illust_ranking(mode_str)
+            illusts = json_result.illusts
+
+        if illusts is None:
+            raise Exception(f"ランキングの取得に失敗しました: {json_result}")
+
+        # 対象タイプの作品だけを先に絞り込む (文字列比較はPythonループのまま)
+        filter_by_type = content_type_value != 'all'
+        candidates = []
         for illust in illusts:
-            if content_type_value != 'all' and illust.type != content_type_value:
+            illust_type = illust.type
+            if illust_type == 'ugoira':
                 continue
-            if illust.type == 'ugoira':
+            if filter_by_type and illust_type != content_type_value:
                 continue
-            
+            candidates.append(illust)
+
+        np = _get_numpy()
+        if np is not None:
+            return self._calculate_engagement_numpy(np, candidates, top_k)
+        return self._calculate_engagement_python(candidates, top_k)
+
+    def _calculate_engagement_numpy(self, np, candidates, top_k=None):
+        """NumPyでしきい値フィルタ・率計算・ソートをまとめて行う (数百件規模で有利)"""
+        if not candidates:
+            return []
+
+        n = len(candidates)
+        views = np.fromiter((i.total_view for i in candidates), dtype=np.int64, count=n)
+        bookmarks = np.fromiter((i.total_bookmarks for i in candidates), dtype=np.int64, count=n)
+
+        mask = (views >= self.min_views_threshold) & (bookmarks >= self.min_bookmarks_threshold)
+        kept = np.nonzero(mask)[0]
+        if kept.size == 0:
+            return []
+
+        kept_views = views[kept]
+        kept_bookmarks = bookmarks[kept]
+        rates = np.round(kept_bookmarks / np.maximum(kept_views, 1) * 100, 2)
+        rates[kept_views == 0] = 0  # 純Python実装と同じ扱い (0除算回避)
+
+        order = np.argsort(-rates, kind='stable')
+        if top_k is not None:
+            # ソート自体はベクトル化済みなので、dictの組み立てだけK件に抑える
+            order = order[:top_k]
+
+        results = []
+        for j in order:
+            illust = candidates[kept[j]]
+            results.append({
+                'id': illust.id,
+                'title': illust.title,
+                'user_name': illust.user.name,
+                'view': int(kept_views[j]),
+                'bookmark': int(kept_bookmarks[j]),
+                'rate': float(rates[j])
+            })
+        return results
+
+    def _calculate_engagement_python(self, candidates, top_k=None):
+        """NumPyが無い環境向けの純Python実装"""
+        engagement_list = []
+        min_views = self.min_views_threshold
+        min_bookmarks = self.min_bookmarks_threshold
+
+        for illust in candidates:
             view = illust.total_view
+            if view < min_views:
+                continue
             bookmark = illust.total_bookmarks
-            
-            if view >= self.min_views_threshold and bookmark >= self.min_bookmarks_threshold:
-                engagement_rate = round((bookmark / view) * 100, 2) if view > 0 else 0 
-                
-                engagement_list.append({
-                    'id': illust.id,
-                    'title': illust.title,
-                    'user_name': illust.user.name,
-                    'view': view,
-                    'bookmark': bookmark,
-                    'rate': engagement_rate
-                })
-                
-        sorted_by_rate = sorted(engagement_list, key=lambda x: x['rate'], reverse=True)
-        return sorted_by_rate
+            if bookmark < min_bookmarks:
+                continue
+
+            engagement_rate = round((bookmark / view) * 100, 2) if view > 0 else 0
+
+            engagement_list.append({
+                'id': illust.id,
+                'title': illust.title,
+                'user_name': illust.user.name,
+                'view': view,
+                'bookmark': bookmark,
+                'rate': engagement_rate
+            })
+
+        if top_k is not None:
+            # 上位K件だけならヒープ選択で済む (sorted(...)[:k] と同じ結果になる)
+            return heapq.nlargest(top_k, engagement_list, key=itemgetter('rate'))
+
+        # C実装のitemgetterキーでインプレースソート (lambdaキーより高速)
+        engagement_list.sort(key=itemgetter('rate'), reverse=True)
+        return engagement_list
 
     # --- 画像ダウンロード機能 ---
     def download_images(self, sorted_list):
@@ -236,134 +746,194 @@ class PixivRankAnalyzer:
         if not sorted_list or not self.enable_download:
             return
 
-        # ダウンロードディレクトリが存在しない場合は作成
-        if not os.path.exists(self.download_dir):
-            os.makedirs(self.download_dir)
-            logging.info(f"📁 ダウンロードディレクトリ '{self.download_dir}' を作成しました。")
-        
+        # ダウンロードディレクトリが存在しない場合は作成 (exist_ok=TrueでTOCTOUレースも回避)
+        Path(self.download_dir).mkdir(parents=True, exist_ok=True)
+
+        # 既存ファイル名を1回のscandirで収集 (名前一致ならネットワークアクセスごと省略できる)
+        self._existing_names = {entry.name for entry in os.scandir(self.download_dir)}
+
         # **【追加されたロジック】既存ファイルのハッシュ値をロード**
         self._load_existing_hashes()
 
         # NOTE: print()はGUI側でログにリダイレクトされる
         print(f"\n--- ブックマーク率トップ {self.download_count} 件の画像をダウンロード中 (保存先: {self.download_dir})... ---")
-        
-        for i, item in enumerate(sorted_list[:self.download_count]):
-            illust_id = item['id']
-            
-            rate_str = f"率{item['rate']:.2f}"
-            bmark_str = f"ブクマ{self._to_k_unit(item['bookmark'])}"
-            view_str = f"閲覧{self._to_k_unit(item['view'])}"
-            sanitized_user = self._sanitize_filename(item['user_name'], max_length=15)
-            sanitized_title = self._sanitize_filename(item['title'], max_length=30) 
-            
-            prefix = f"{rate_str}_{bmark_str}_{view_str}_{sanitized_user}_{sanitized_title}"
-            
-            print(f"ダウンロード開始: {prefix} ({i+1}/{self.download_count})", end='...')
-            
-            try:
-                json_result = self.api.illust_detail(illust_id) 
-                illust_object = json_result.illust 
-
-                image_urls = []
-                if illust_object.meta_pages:
-                    image_urls = [p.image_urls.original for p in illust_object.meta_pages]
-                elif illust_object.meta_single_page.original_image_url:
-                    image_urls = [illust_object.meta_single_page.original_image_url]
-                
-            except Exception as e:
-                logging.error(f"❌ ID {illust_id} の情報取得中にエラーが発生しました: {e}")
-                print(f"\r❌ 情報取得失敗。ログを確認してください。")
-                self._rand_sleep() 
+
+        # ダウンロードはI/O待ちが支配的なため、作品単位でワーカースレッドに分配する
+        targets = sorted_list[:self.download_count]
+
+        if self.max_workers == 1:
+            # 並列数1のときは詳細取得だけを1件先読みするパイプラインに切り替える
+            self._download_serial_with_prefetch(targets)
+        else:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = [executor.submit(self._download_one, item, i) for i, item in enumerate(targets)]
+                for future in as_completed(futures):
+                    status_line = future.result()
+                    with self._print_lock:
+                        print(status_line)
+
+        # 今回の結果を含めてサイドカーインデックスを保存する
+        self._save_hash_index()
+
+    def _fetch_detail(self, illust_id):
+        """レート制限を挟んで作品詳細を取得する"""
+        self._rate_limiter.wait()
+        return self.api.illust_detail(illust_id)
+
+    def _download_serial_with_prefetch(self, targets):
+        """逐次ダウンロード + 詳細の1件先読み。
+
+        N件目のページダウンロード中にバックグラウンドスレッドがN+1件目の
+        illust_detail を取得しておくことで、詳細取得のRTTをダウンロード時間の
+        裏に隠す。並列ダウンロード (max_workers >= 2) ではExecutorが同じ効果を
+        持つため、この経路は並列数1の構成でのみ使われる。
+        """
+        result_queue = queue.Queue(maxsize=1)
+
+        def _prefetcher():
+            for item in targets:
+                try:
+                    detail = self._fetch_detail(item['id'])
+                except Exception as e:  # 呼び出し側でエラー表示するため例外も運ぶ
+                    detail = e
+                result_queue.put((item, detail))
+            result_queue.put(None)
+
+        threading.Thread(target=_prefetcher, daemon=True).start()
+
+        i = 0
+        while True:
+            entry = result_queue.get()
+            if entry is None:
+                break
+            item, detail = entry
+            status_line = self._download_one(item, i, prefetched=detail)
+            with self._print_lock:
+                print(status_line)
+            i += 1
+
+    def _download_one(self, item, i, prefetched=None):
+        """1作品分の詳細取得とページダウンロードを行い、結果のステータス行を返す (ワーカースレッドから呼ばれる)"""
+        illust_id = item['id']
+
+        # 整形済みの部品を_joinで1回だけ連結する (f-stringの入れ子より中間文字列が少ない)
+        prefix = "_".join((
+            f"率{item['rate']:.2f}",
+            "ブクマ" + self._to_k_unit(item['bookmark']),
+            "閲覧" + self._to_k_unit(item['view']),
+            self._sanitize_filename(item['user_name'], max_length=15),
+            self._sanitize_filename(item['title'], max_length=30),
+        ))
+
+        with self._print_lock:
+            print(f"ダウンロード開始: {prefix} ({i+1}/{self.download_count})...")
+
+        try:
+            if prefetched is None:
+                prefetched = self._fetch_detail(illust_id)
+            if isinstance(prefetched, Exception):
+                raise prefetched
+            json_result = prefetched
+            illust_object = json_result.illust
+
+            image_urls = []
+            if illust_object.meta_pages:
+                image_urls = [p.image_urls.original for p in illust_object.meta_pages]
+            elif illust_object.meta_single_page.original_image_url:
+                image_urls = [illust_object.meta_single_page.original_image_url]
+
+        except Exception as e:
+            logging.error(f"❌ ID {illust_id} の情報取得中にエラーが発生しました: {e}")
+            return f"❌ 情報取得失敗: {prefix} (ログを確認してください)"
+
+        success_count = 0
+
+        # os.path.basename + splitext の代わりに文字列分割で拡張子を取り出す。
+        # ページ間で拡張子は共通なことが多いため、ループの前に一括で求めておく
+        exts = []
+        for url in image_urls:
+            tail = url.rpartition('/')[2]
+            exts.append('.' + tail.rpartition('.')[2] if '.' in tail else '')
+
+        download_dir = self.download_dir
+        multi_page = len(image_urls) > 1
+
+        for idx, url in enumerate(image_urls):
+            page_suffix = f"_p{idx + 1}" if multi_page else ""
+            final_file_name = ''.join((prefix, page_suffix, exts[idx]))
+            final_filepath = os.path.join(download_dir, final_file_name)
+
+            is_page_downloaded = False
+            is_duplicate = False
+
+            # ダウンロード前にファイル名が重複しているかチェック (※これはハッシュチェックとは別)
+            # scandirで収集済みの集合を見るだけなので、stat(2)もハッシュ再計算も発生しない
+            if final_file_name in self._existing_names:
+                with self._print_lock:
+                    print(f"♻️ スキップ (ダウンロード済み): {final_file_name}")
+                success_count += 1
                 continue
-                
-            success_count = 0
-            
-            for idx, url in enumerate(image_urls):
-                original_file_name = os.path.basename(url)
-                _, ext = os.path.splitext(original_file_name)
-                page_num = idx + 1
-                page_suffix = f"_p{page_num}" if len(image_urls) > 1 else ""
-                final_file_name = f"{prefix}{page_suffix}{ext}"
-                temp_filepath = os.path.join(self.download_dir, final_file_name)
-
-                is_page_downloaded = False
-                is_duplicate = False
-                
-                # ダウンロード前にファイル名が重複しているかチェック (※これはハッシュチェックとは別)
-                if os.path.exists(temp_filepath):
-                    temp_hash = self._calculate_file_hash(temp_filepath)
-                    if temp_hash in self.existing_hashes:
-                         print(f"\r♻️ スキップ (ファイル名/ハッシュ重複): {final_file_name}")
-                         success_count += 1
-                         is_page_downloaded = True
-                         is_duplicate = True
-                         continue
-
-                if not is_duplicate:
-                    for attempt in range(3):
-                        try:
-                            # 既存のファイル名を上書きしてダウンロードを実行
-                            if self.api.download(url, path=self.download_dir, name=final_file_name):
-                                
-                                # **【追加されたロジック】ダウンロード後のハッシュチェック**
-                                downloaded_hash = self._calculate_file_hash(temp_filepath)
-                                
-                                if downloaded_hash and downloaded_hash in self.existing_hashes:
-                                    # 重複を発見したらファイルを削除
-                                    os.remove(temp_filepath)
-                                    existing_file = self.existing_hashes[downloaded_hash]
-                                    print(f"\r♻️ スキップ (内容重複): {final_file_name} は {existing_file} と同一のため削除しました。")
-                                    is_duplicate = True
-                                else:
-                                    # 新規ファイルとしてハッシュを登録
-                                    if downloaded_hash:
-                                        self.existing_hashes[downloaded_hash] = final_file_name
-                                    
-                                    success_count += 1
-                                    is_page_downloaded = True
-                                    self._rand_sleep()
-                                    break 
-                                    
-                            else:
-                                is_page_downloaded = True 
-                                break
-                                
-                        except Exception as e:
-                            logging.warning(f"  [Attempt {attempt+1}] Download {final_file_name} failed: {e}")
-                            self._rand_sleep()
-                        
-                        if is_duplicate: # 重複でスキップした場合は次のページへ
-                            break
-
-                if not is_page_downloaded and not is_duplicate:
-                    logging.error(f"❌ 警告: ID {illust_id} のページ{idx+1} ({final_file_name}) は3回の試行でダウンロードできませんでした。")
-
-            if success_count == len(image_urls) and len(image_urls) > 0:
-                print(f"\r✅ ダウンロード完了: {prefix} ({success_count}枚)")
-            elif len(image_urls) == 0:
-                print(f"\r⚠️ ID {illust_id} はダウンロード可能な画像が見つかりませんでした。")
-            elif success_count > 0:
-                 # 一部が重複スキップまたはダウンロード失敗した場合
-                print(f"\r⚠️ ダウンロード完了: {prefix} ({success_count}枚成功 / {len(image_urls) - success_count}枚スキップ/失敗)")
-            else:
-                print(f"\r❌ ダウンロード失敗/全て重複スキップ: {prefix}")
+
+            for attempt in range(3):
+                try:
+                    # ストリーミング保存 + 書き込みと同時のハッシュ計算で重複判定まで行う
+                    self._rate_limiter.wait()
+                    is_duplicate, existing_file = self._download_image(url, final_filepath)
+
+                    if is_duplicate:
+                        with self._print_lock:
+                            print(f"♻️ スキップ (内容重複): {final_file_name} は {existing_file} と同一のため破棄しました。")
+                    else:
+                        success_count += 1
+                        is_page_downloaded = True
+                    break
+
+                except Exception as e:
+                    logging.warning(f"  [Attempt {attempt+1}] Download {final_file_name} failed: {e}")
+                    self._rand_sleep()
+
+            if not is_page_downloaded and not is_duplicate:
+                logging.error(f"❌ 警告: ID {illust_id} のページ{idx+1} ({final_file_name}) は3回の試行でダウンロードできませんでした。")
+
+        if success_count == len(image_urls) and len(image_urls) > 0:
+            return f"✅ ダウンロード完了: {prefix} ({success_count}枚)"
+        elif len(image_urls) == 0:
+            return f"⚠️ ID {illust_id} はダウンロード可能な画像が見つかりませんでした。"
+        elif success_count > 0:
+            # 一部が重複スキップまたはダウンロード失敗した場合
+            return f"⚠️ ダウンロード完了: {prefix} ({success_count}枚成功 / {len(image_urls) - success_count}枚スキップ/失敗)"
+        else:
+            return f"❌ ダウンロード失敗/全て重複スキップ: {prefix}"
 
 
 # --- ロギング設定 ---
 
 def setup_logging():
+    """キュー経由の非同期ロギングを初期化し、QueueListenerを返す。
+
+    ワーカースレッドはQueueHandler経由でレコードを投入するだけで、ファイルへの
+    書き込みはリスナースレッド1本に集約される。これによりFileHandler内部の
+    ロック待ちで並列ダウンロードが直列化されるのを防ぐ。
+    呼び出し側はアプリ終了時に listener.stop() を呼ぶこと。
+    """
     log_file = 'pixiv_analysis.log'
-    # ロギング設定の初期化
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(log_file, encoding='utf-8', mode='a'),
-            # GUIがない場合はsys.stdoutに流す
-            logging.StreamHandler(sys.stdout) 
-        ]
-    )
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+
+    file_handler = logging.FileHandler(log_file, encoding='utf-8', mode='a')
+    file_handler.setFormatter(formatter)
+    # GUIがない場合はsys.stdoutに流す (リダイレクト前のstdoutを束縛する)
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(-1)
+    listener = QueueListener(log_queue, file_handler, stream_handler)
+    listener.start()
+
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.INFO)
+    root_logger.handlers = [QueueHandler(log_queue)]
     logging.getLogger('pixivpy3').setLevel(logging.INFO)
+    return listener
 
 if __name__ == "__main__":
     # モジュール単体テスト用のコード (通常はGUI側から呼び出すため不要)
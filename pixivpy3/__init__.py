@@ -1,7 +1,28 @@
 """Pixiv API library"""
 
-from .aapi import AppPixivAPI
-from .bapi import ByPassSniApi
-from .utils import PixivError
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from .aapi import AppPixivAPI
+    from .bapi import ByPassSniApi
+    from .utils import PixivError
 
 __all__ = ("AppPixivAPI", "ByPassSniApi", "PixivError")
+
+
+# PEP 562: 重い依存 (requests/cloudscraper等) の読み込みを初回アクセスまで遅延する
+def __getattr__(name: str) -> Any:
+    if name == "AppPixivAPI":
+        from .aapi import AppPixivAPI
+
+        return AppPixivAPI
+    if name == "ByPassSniApi":
+        from .bapi import ByPassSniApi
+
+        return ByPassSniApi
+    if name == "PixivError":
+        from .utils import PixivError
+
+        return PixivError
+    msg = f"module {__name__!r} has no attribute {name!r}"
+    raise AttributeError(msg)
@@ -0,0 +1,300 @@
+from __future__ import annotations
+
+from unittest.mock import MagicMock, Mock
+
+from pixivpy3.PixivRankAnalyzer import ContentType, PixivRankAnalyzer, RankingMode
+from pixivpy3.utils import JsonDict
+
+
+def _illust(
+    id: int,
+    type: str = 'illust',
+    view: int = 10000,
+    bookmark: int = 1000,
+) -> JsonDict:
+    return JsonDict(
+        id=id,
+        title=f'title{id}',
+        type=type,
+        total_view=view,
+        total_bookmarks=bookmark,
+        user=JsonDict(name=f'user{id}'),
+    )
+
+
+def _analyzer(**kwargs: object) -> PixivRankAnalyzer:
+    params: dict = dict(
+        ranking_mode=RankingMode.DAILY,
+        content_type=ContentType.ALL,
+        min_views=1000,
+        min_bookmarks=100,
+        download_count=10,
+    )
+    params.update(kwargs)
+    return PixivRankAnalyzer(**params)
+
+
+class TestSanitizeFilename:
+    def test_replaces_forbidden_chars(self) -> None:
+        assert PixivRankAnalyzer._sanitize_filename('a/b:c*d') == 'aーbーcーd'
+
+    def test_strips_control_chars_and_newlines(self) -> None:
+        assert PixivRankAnalyzer._sanitize_filename('ab\ncd\x01\x1f') == 'ab cd'
+
+    def test_truncates_to_max_length(self) -> None:
+        assert PixivRankAnalyzer._sanitize_filename('x' * 50, max_length=10) == 'x' * 10
+
+    def test_normalizes_nfkc(self) -> None:
+        # 全角英数はNFKCで半角に正規化される
+        assert PixivRankAnalyzer._sanitize_filename('ＡＢＣ１２３') == 'ABC123'
+
+
+class TestCalculateEngagement:
+    def test_sorted_by_rate_descending(self) -> None:
+        analyzer = _analyzer()
+        analyzer.api = Mock()
+        analyzer.api.illust_ranking.return_value = JsonDict(
+            illusts=[
+                _illust(1, view=10000, bookmark=1000),  # 10%
+                _illust(2, view=10000, bookmark=3000),  # 30%
+                _illust(3, view=10000, bookmark=2000),  # 20%
+            ]
+        )
+
+        results = analyzer.calculate_engagement()
+        assert [r['id'] for r in results] == [2, 3, 1]
+        assert results[0]['rate'] == 30.0
+
+    def test_filters_thresholds_type_and_ugoira(self) -> None:
+        analyzer = _analyzer(content_type=ContentType.ILLUST)
+        analyzer.api = Mock()
+        analyzer.api.illust_ranking.return_value = JsonDict(
+            illusts=[
+                _illust(1),
+                _illust(2, type='ugoira'),
+                _illust(3, type='manga'),
+                _illust(4, view=500),       # 閲覧数がしきい値未満
+                _illust(5, bookmark=50),    # ブクマ数がしきい値未満
+            ]
+        )
+
+        results = analyzer.calculate_engagement()
+        assert [r['id'] for r in results] == [1]
+
+    def test_cached_token_rejection_triggers_reauth(self, monkeypatch: object) -> None:
+        # キャッシュ済みトークンが拒否された場合はキャッシュを捨てて再認証し、
+        # ランキングを1回だけ取り直すこと
+        analyzer = _analyzer()
+        analyzer.api = Mock()
+        analyzer._auth_from_cache = True
+        analyzer._refresh_token = 'refresh'
+        analyzer.api.illust_ranking.side_effect = [
+            JsonDict(illusts=None),  # 失効トークンに対するエラー応答
+            JsonDict(illusts=[_illust(1)]),
+        ]
+        monkeypatch.setattr(analyzer, '_invalidate_token_cache', Mock())
+        monkeypatch.setattr(analyzer, '_full_auth', Mock())
+
+        results = analyzer.calculate_engagement()
+
+        assert [r['id'] for r in results] == [1]
+        analyzer._invalidate_token_cache.assert_called_once_with()
+        analyzer._full_auth.assert_called_once_with('refresh')
+
+    def test_top_k_matches_full_sort(self, monkeypatch: object) -> None:
+        analyzer = _analyzer(min_views=0, min_bookmarks=0)
+        analyzer.api = Mock()
+        analyzer.api.illust_ranking.return_value = JsonDict(
+            illusts=[
+                _illust(1, view=10000, bookmark=1000),
+                _illust(2, view=10000, bookmark=3000),
+                _illust(3, view=10000, bookmark=2000),
+                _illust(4, view=10000, bookmark=500),
+            ]
+        )
+        full = analyzer.calculate_engagement()
+        assert analyzer.calculate_engagement(top_k=2) == full[:2]
+
+        # 純Python経路 (heapq.nlargest) でも同じ結果になること
+        import pixivpy3.PixivRankAnalyzer as core
+
+        monkeypatch.setattr(core, '_np', None)
+        monkeypatch.setattr(core, '_np_checked', True)
+        assert analyzer.calculate_engagement(top_k=2) == full[:2]
+
+    def test_numpy_and_python_paths_agree(self, monkeypatch: object) -> None:
+        illusts = [
+            _illust(1, view=10000, bookmark=1000),
+            _illust(2, view=20000, bookmark=9000),
+            _illust(3, view=0, bookmark=500),
+            _illust(4, view=5000, bookmark=500),
+        ]
+        analyzer = _analyzer(min_views=0, min_bookmarks=0)
+        analyzer.api = Mock()
+        analyzer.api.illust_ranking.return_value = JsonDict(illusts=illusts)
+        default_results = analyzer.calculate_engagement()
+
+        # NumPyを無効化して純Python実装の結果と比較
+        import pixivpy3.PixivRankAnalyzer as core
+
+        monkeypatch.setattr(core, '_np', None)
+        monkeypatch.setattr(core, '_np_checked', True)
+        fallback_results = analyzer.calculate_engagement()
+
+        assert default_results == fallback_results
+
+
+def _expected_fingerprint(data: bytes) -> str:
+    # 実装と同じアルゴリズム (xxh3優先、無ければsha256) で期待値を作る
+    from pixivpy3.PixivRankAnalyzer import _HASH_NAME, _new_hasher
+
+    return f'{_HASH_NAME}:{_new_hasher(data).hexdigest()}'
+
+
+class TestCalculateFileHash:
+    def test_small_file(self, tmp_path) -> None:
+        path = tmp_path / 'small.bin'
+        path.write_bytes(b'hello world')
+        assert PixivRankAnalyzer._calculate_file_hash(str(path)) == _expected_fingerprint(b'hello world')
+
+    def test_large_file_uses_same_digest(self, tmp_path) -> None:
+        # mmap経路 (1MiB以上) でもチャンク読みと同じ結果になること
+        data = b'x' * (2 * 1024 * 1024)
+        path = tmp_path / 'large.bin'
+        path.write_bytes(data)
+        assert PixivRankAnalyzer._calculate_file_hash(str(path)) == _expected_fingerprint(data)
+
+    def test_empty_file(self, tmp_path) -> None:
+        path = tmp_path / 'empty.bin'
+        path.write_bytes(b'')
+        assert PixivRankAnalyzer._calculate_file_hash(str(path)) == _expected_fingerprint(b'')
+
+    def test_digest_is_algorithm_prefixed(self, tmp_path) -> None:
+        path = tmp_path / 'file.bin'
+        path.write_bytes(b'data')
+        digest = PixivRankAnalyzer._calculate_file_hash(str(path))
+        assert digest is not None
+        assert digest.startswith(('xxh3:', 'sha256:'))
+
+    def test_missing_file_returns_none(self, tmp_path) -> None:
+        assert PixivRankAnalyzer._calculate_file_hash(str(tmp_path / 'nope')) is None
+
+
+class TestDownloadImage:
+    @staticmethod
+    def _session_streaming(data: bytes) -> Mock:
+        response = MagicMock()
+        response.__enter__.return_value = response
+        response.iter_content.return_value = [data]
+        session = Mock()
+        session.get.return_value = response
+        return session
+
+    def test_new_file_is_saved_and_registered(self, tmp_path) -> None:
+        analyzer = _analyzer()
+        analyzer._img_session = self._session_streaming(b'image-bytes')
+        target = tmp_path / 'a.jpg'
+
+        is_duplicate, existing = analyzer._download_image('https://x/a.jpg', str(target))
+
+        assert not is_duplicate
+        assert existing is None
+        assert target.read_bytes() == b'image-bytes'
+        assert _expected_fingerprint(b'image-bytes') in analyzer.existing_hashes
+
+    def test_duplicate_content_is_discarded(self, tmp_path) -> None:
+        analyzer = _analyzer()
+        fingerprint = _expected_fingerprint(b'image-bytes')
+        analyzer.existing_hashes.add(fingerprint)
+        analyzer.existing_sizes.add(len(b'image-bytes'))
+        analyzer._hash_to_name[fingerprint] = 'orig.jpg'
+        analyzer._img_session = self._session_streaming(b'image-bytes')
+        target = tmp_path / 'b.jpg'
+
+        is_duplicate, existing = analyzer._download_image('https://x/b.jpg', str(target))
+
+        assert is_duplicate
+        assert existing == 'orig.jpg'
+        # 重複は最終ファイルも一時ファイルも残さない
+        assert not target.exists()
+        assert not (tmp_path / 'b.jpg.part').exists()
+
+    def test_duplicate_on_disk_detected_via_fingerprint(self, tmp_path) -> None:
+        # 指紋のみ取得済みの既存ファイルでも、衝突時の昇格で重複として検出されること
+        analyzer = _analyzer()
+        analyzer.download_dir = str(tmp_path)
+        (tmp_path / 'orig.jpg').write_bytes(b'image-bytes')
+        analyzer._load_existing_hashes()
+        analyzer._img_session = self._session_streaming(b'image-bytes')
+
+        is_duplicate, existing = analyzer._download_image('https://x/b.jpg', str(tmp_path / 'b.jpg'))
+
+        assert is_duplicate
+        assert existing == 'orig.jpg'
+        assert not (tmp_path / 'b.jpg').exists()
+
+
+class TestHashIndex:
+    def test_reuses_cached_hash_without_rehashing(self, tmp_path, monkeypatch) -> None:
+        analyzer = _analyzer()
+        analyzer.download_dir = str(tmp_path)
+        (tmp_path / 'a.jpg').write_bytes(b'image-bytes')
+
+        # 初回スキャンは指紋のみ。同一内容のダウンロードで全量ハッシュへ昇格し、
+        # インデックスに記録される
+        analyzer._load_existing_hashes()
+        fingerprint = _expected_fingerprint(b'image-bytes')
+        assert fingerprint not in analyzer.existing_hashes
+        analyzer._img_session = TestDownloadImage._session_streaming(b'image-bytes')
+        is_duplicate, _ = analyzer._download_image('https://x/b.jpg', str(tmp_path / 'b.jpg'))
+        assert is_duplicate
+        analyzer._save_hash_index()
+
+        # 2回目はstatが一致するため再ハッシュされないこと
+        monkeypatch.setattr(
+            PixivRankAnalyzer, '_calculate_file_hash',
+            staticmethod(lambda *a, **kw: (_ for _ in ()).throw(AssertionError('rehashed'))),
+        )
+        analyzer._load_existing_hashes()
+        assert fingerprint in analyzer.existing_hashes
+
+    def test_rehashes_when_file_changed(self, tmp_path) -> None:
+        analyzer = _analyzer()
+        analyzer.download_dir = str(tmp_path)
+        path = tmp_path / 'a.jpg'
+        path.write_bytes(b'old-bytes')
+        analyzer._load_existing_hashes()
+        analyzer._img_session = TestDownloadImage._session_streaming(b'old-bytes')
+        analyzer._download_image('https://x/b.jpg', str(tmp_path / 'b.jpg'))
+        analyzer._save_hash_index()
+
+        # 内容が変わるとインデックスエントリは無効になり、古いハッシュは消える
+        path.write_bytes(b'new-bytes')
+        analyzer._load_existing_hashes()
+        assert _expected_fingerprint(b'old-bytes') not in analyzer.existing_hashes
+
+
+class TestFastFingerprint:
+    def test_stream_and_file_fingerprints_agree(self, tmp_path) -> None:
+        # ダウンロード側 (_fingerprint_parts) とスキャン側 (_fast_fingerprint) が
+        # 同じ指紋を出すこと。2KB以下・以上の両方を確認する
+        for data in (b'short', b'x' * 5000):
+            path = tmp_path / 'f.bin'
+            path.write_bytes(data)
+            span = PixivRankAnalyzer._FP_SPAN
+            expected = PixivRankAnalyzer._fingerprint_parts(
+                len(data), data[:span], data[max(0, len(data) - span):]
+            )
+            assert PixivRankAnalyzer._fast_fingerprint(str(path)) == expected
+
+    def test_missing_file_returns_none(self, tmp_path) -> None:
+        assert PixivRankAnalyzer._fast_fingerprint(str(tmp_path / 'nope')) is None
+
+
+class TestToKUnit:
+    def test_below_thousand(self) -> None:
+        assert PixivRankAnalyzer._to_k_unit(999) == '999'
+
+    def test_thousands(self) -> None:
+        assert PixivRankAnalyzer._to_k_unit(1500) == '1K'
+        assert PixivRankAnalyzer._to_k_unit(10000) == '10K'